@@ -1,14 +1,25 @@
-from fastapi import FastAPI, HTTPException, Header
-from fastapi.responses import HTMLResponse, JSONResponse
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Header, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response
+import msgspec
+import pybase64
 import os
-import json
 import asyncio
 import time
 import hmac
+import gzip
+import brotli
+import hashlib
 from pathlib import Path
 
-app = FastAPI()
+# Reused C-level JSON encoder (cached bodies, state file, default responses)
+_ENC = msgspec.json.Encoder()
+
+class MsgspecResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return _ENC.encode(content)
+
+# Any route returning plain data goes through msgspec, never stdlib json
+app = FastAPI(default_response_class=MsgspecResponse)
 
 # ======================================================
 # CONFIG (Render: set env vars)
@@ -18,6 +29,7 @@ GATE_PASS = os.getenv("GATE_PASS", "")
 if not GATE_PASS:
     # Keep server runnable locally, but strongly recommended to set in env
     GATE_PASS = "CHANGE_ME"
+GATE_PASS_B = GATE_PASS.encode("utf-8")
 
 # Best-effort persistence file (works if filesystem survives; harmless if wiped)
 STATE_FILE = Path(os.getenv("STATE_FILE", "/tmp/_g.bin"))
@@ -47,97 +59,181 @@ C_ERR = 520
 # ======================================================
 # STATE (single payload)
 # ======================================================
-class Payload(BaseModel):
+class Payload(msgspec.Struct):
     nonce: str
     data: str
 
+# Reused typed decoder for /update bodies and the state file
+_DEC = msgspec.json.Decoder(Payload)
+
+# {"c": code} bodies are a fixed set: prebuilt, shared responses
+_RESP = {
+    c: Response(_ENC.encode({"c": c}), media_type="application/json", headers={"Cache-Control": "no-store"})
+    for c in (C_OK, C_NEED, C_DENY, C_BAD, C_BUSY, C_NR, C_ERR)
+}
+
 app.state.lock = asyncio.Lock()
 app.state.payload = None  # dict: {"nonce": "...", "data": "..."}
+app.state.payload_bytes = None  # serialized JSON of payload (built once per update)
+app.state.payload_bin = None  # nonce_len (2B LE) || nonce || data, raw bytes
+app.state.payload_bin_etag = None  # ETag of payload_bin
 app.state.updated_at = None  # unix ts
 
+# Persistence runs off the request path; only the latest state is written
+_NO_WRITE = object()
+app.state.pending_write = _NO_WRITE  # dict to write, None to wipe
+app.state.writer = None  # background drain task
+
 # ======================================================
 # HELPERS
 # ======================================================
 def _auth(x_pass: str | None) -> None:
-    # Constant-time compare
-    if not x_pass or not hmac.compare_digest(x_pass, GATE_PASS):
+    if not x_pass:
+        raise HTTPException(status_code=403, detail=C_DENY)
+    # Constant-time compare on bytes (str form rejects non-ASCII with TypeError)
+    if not hmac.compare_digest(x_pass.encode("utf-8"), GATE_PASS_B):
         raise HTTPException(status_code=403, detail=C_DENY)
 
-def _validate_payload(p: Payload) -> None:
+def _decode_payload(raw: bytes) -> Payload:
+    # Types/shape enforced by the typed decoder
+    try:
+        return _DEC.decode(raw)
+    except msgspec.DecodeError:
+        raise HTTPException(status_code=400, detail=C_BAD) from None
+
+def _validate_payload(p: Payload) -> tuple[bytes, bytes]:
     if not p.nonce or not p.data:
         raise HTTPException(status_code=400, detail=C_BAD)
     if len(p.nonce) > MAX_NONCE_LEN or len(p.data) > MAX_DATA_LEN:
         raise HTTPException(status_code=413, detail=C_BAD)
+    # Strict (SIMD) base64 check; decoded bytes are kept for /payload.bin
+    try:
+        return (
+            pybase64.b64decode(p.nonce, validate=True),
+            pybase64.b64decode(p.data, validate=True),
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail=C_BAD) from None
+
+def _encode_payload(obj: dict) -> bytes:
+    return _ENC.encode(obj)
+
+def _encode_payload_bin(nonce: bytes, data: bytes) -> bytes:
+    return len(nonce).to_bytes(2, "little") + nonce + data
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+
+def _not_modified(request: Request, etag: str) -> bool:
+    return etag in request.headers.get("if-none-match", "")
+
+async def _set_payload(obj: dict, nonce_raw: bytes, data_raw: bytes) -> None:
+    # Build everything outside the lock; the critical section is a pure swap
+    payload_bytes = _encode_payload(obj)
+    payload_bin = _encode_payload_bin(nonce_raw, data_raw)
+    payload_bin_etag = _etag(payload_bin)
+    ts = time.time()
+    async with app.state.lock:
+        # Single payload: replace allowed (simple)
+        app.state.payload = obj
+        app.state.payload_bytes = payload_bytes
+        app.state.payload_bin = payload_bin
+        app.state.payload_bin_etag = payload_bin_etag
+        app.state.updated_at = ts
+
+def _conditional(request: Request, body: bytes, etag: str, media_type: str) -> Response:
+    headers = {"Cache-Control": "no-store", "ETag": etag}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=media_type, headers=headers)
 
 def _atomic_write_json(path: Path, obj: dict) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     tmp = path.with_suffix(path.suffix + ".tmp")
-    with tmp.open("w", encoding="utf-8") as f:
-        json.dump(obj, f, separators=(",", ":"))
+    with tmp.open("wb") as f:
+        f.write(_ENC.encode(obj))
         f.flush()
         os.fsync(f.fileno())
     os.replace(tmp, path)
 
-def _best_effort_load() -> dict | None:
+def _best_effort_load() -> Payload | None:
+    # One read, no exists() stat; typed decode checks shape and field types
     try:
-        if not STATE_FILE.exists():
-            return None
-        raw = STATE_FILE.read_text(encoding="utf-8")
-        obj = json.loads(raw)
-        if not isinstance(obj, dict):
-            return None
-        if "nonce" not in obj or "data" not in obj:
-            return None
-        # sanity limits
-        if (not isinstance(obj["nonce"], str)) or (not isinstance(obj["data"], str)):
-            return None
-        if len(obj["nonce"]) > MAX_NONCE_LEN or len(obj["data"]) > MAX_DATA_LEN:
-            return None
-        return {"nonce": obj["nonce"], "data": obj["data"]}
-    except Exception:
+        raw = STATE_FILE.read_bytes()
+    except OSError:
+        return None
+    try:
+        return _DEC.decode(raw)
+    except msgspec.DecodeError:
         return None
 
 def _best_effort_clear_file() -> None:
     try:
-        if STATE_FILE.exists():
-            STATE_FILE.unlink()
+        STATE_FILE.unlink(missing_ok=True)
+    except Exception:
+        pass
+
+def _persist(obj: dict | None) -> None:
+    # Runs in a worker thread (fsync must not block the loop)
+    try:
+        if obj is None:
+            _best_effort_clear_file()
+        else:
+            _atomic_write_json(STATE_FILE, obj)
     except Exception:
+        # Ignore: compatibility mode
         pass
 
+async def _drain_writes() -> None:
+    # Bursty updates collapse into one write of the newest state
+    while app.state.pending_write is not _NO_WRITE:
+        obj = app.state.pending_write
+        app.state.pending_write = _NO_WRITE
+        await asyncio.to_thread(_persist, obj)
+
+def _schedule_persist(obj: dict | None) -> None:
+    app.state.pending_write = obj
+    if app.state.writer is None or app.state.writer.done():
+        app.state.writer = asyncio.create_task(_drain_writes())
+
 # ======================================================
 # STARTUP: restore from file if available (optional)
 # ======================================================
 @app.on_event("startup")
 async def _startup_restore():
     restored = _best_effort_load()
-    if restored:
-        async with app.state.lock:
-            app.state.payload = restored
-            app.state.updated_at = time.time()
+    if restored is None:
+        return
+    # Same sanity limits / base64 check as /update
+    try:
+        nonce_raw, data_raw = _validate_payload(restored)
+    except HTTPException:
+        return
+    obj = {"nonce": restored.nonce, "data": restored.data}
+    await _set_payload(obj, nonce_raw, data_raw)
+
+@app.on_event("shutdown")
+async def _shutdown_flush():
+    # Don't drop a queued write on spin-down
+    if app.state.writer is not None:
+        await app.state.writer
 
 # ======================================================
 # 1) UPDATE (password required)
 # ======================================================
 @app.post("/update")
-async def update_tunnel(payload: Payload, x_pass: str = Header(None)):
+async def update_tunnel(request: Request, x_pass: str = Header(None)):
     _auth(x_pass)
-    _validate_payload(payload)
+    payload = _decode_payload(await request.body())
+    nonce_raw, data_raw = _validate_payload(payload)
 
     obj = {"nonce": payload.nonce, "data": payload.data}
-
-    async with app.state.lock:
-        # Single payload: replace allowed (simple)
-        app.state.payload = obj
-        app.state.updated_at = time.time()
+    await _set_payload(obj, nonce_raw, data_raw)
 
     # Best-effort persistence (if FS survives, it restores after spin-down; if not, server behaves like RAM-only)
-    try:
-        _atomic_write_json(STATE_FILE, obj)
-    except Exception:
-        # Ignore: compatibility mode
-        pass
+    _schedule_persist(obj)
 
-    return {"c": C_OK}
+    return _RESP[C_OK]
 
 # ======================================================
 # 2) END (password required) - only explicit wipe
@@ -147,20 +243,40 @@ async def end_tunnel(x_pass: str = Header(None)):
     _auth(x_pass)
     async with app.state.lock:
         app.state.payload = None
+        app.state.payload_bytes = None
+        app.state.payload_bin = None
+        app.state.payload_bin_etag = None
         app.state.updated_at = None
-    _best_effort_clear_file()
-    return {"c": C_OK}
+    # Queued behind any pending write so a late write can't resurrect the file
+    _schedule_persist(None)
+    return _RESP[C_OK]
 
 # ======================================================
 # 3) PAYLOAD (blind fetch)
 # ======================================================
-@app.get("/payload")
+@app.api_route("/payload", methods=["GET", "HEAD"])
 async def get_payload():
-    async with app.state.lock:
-        if not app.state.payload:
-            # No hints
-            raise HTTPException(status_code=503, detail=C_NR)
-        return JSONResponse(app.state.payload, headers={"Cache-Control": "no-store"})
+    # No lock: writers swap the cached body wholesale, readers take one reference
+    body = app.state.payload_bytes
+    if not body:
+        # No hints
+        raise HTTPException(status_code=503, detail=C_NR)
+    # Body is serialized once in /update; just ship the cached bytes
+    return Response(body, media_type="application/json", headers={"Cache-Control": "no-store"})
+
+@app.api_route("/payload.bin", methods=["GET", "HEAD"])
+async def get_payload_bin(request: Request):
+    # Same payload, already base64-decoded: client skips its own decode pass.
+    # The page revalidates with If-None-Match from memory (no-store stays).
+    body = app.state.payload_bin
+    if not body:
+        raise HTTPException(status_code=503, detail=C_NR)
+    return _conditional(request, body, app.state.payload_bin_etag, "application/octet-stream")
+
+@app.get("/status")
+async def get_status():
+    # Existence probe for the page: a few bytes instead of the payload
+    return _RESP[C_OK] if app.state.payload_bytes else _RESP[C_NR]
 
 # ======================================================
 # 4) WEB GATE (no readable hints)
@@ -184,9 +300,6 @@ HTML_PAGE = """
 
 * {
   box-sizing:border-box;
-}
-
-* {
   -webkit-user-select:none;
   -webkit-touch-callout:none;
   user-select:none;
@@ -369,8 +482,9 @@ document.addEventListener("click", function(e) {
 
 async function check() {
   try {
-    const res = await fetch("/payload", { cache: "no-store" });
-    if (res.ok) {
+    const res = await fetch("/status", { cache: "no-store" });
+    const ok = res.ok && (await res.json()).c === 100;
+    if (ok) {
       document.getElementById("card").style.display = "block";
     } else {
       document.getElementById("status").style.display = "block";
@@ -382,6 +496,14 @@ async function check() {
 
 function hexToBytes(hex) {
   if (hex.length !== 64) return null;
+  if (Uint8Array.fromHex) {
+    try {
+      const u = Uint8Array.fromHex(hex);
+      return u.length === 32 ? u : null;
+    } catch (e) {
+      return null;
+    }
+  }
   const out = new Uint8Array(32);
   for (let i = 0; i < 32; i++) {
     const b = parseInt(hex.substr(i * 2, 2), 16);
@@ -402,14 +524,12 @@ async function unlock() {
     return;
   }
 
-  const res = await fetch("/payload", { cache: "no-store" });
-  if (!res.ok) {
+  const payload = await fetchPayload();
+  if (!payload) {
     err.textContent = "503";
     return;
   }
 
-  const payload = await res.json();
-
   try {
     const url = await decryptAES(keyBytes, payload.nonce, payload.data);
     window.location.href = url;
@@ -418,10 +538,42 @@ async function unlock() {
   }
 }
 
-async function decryptAES(keyBytes, nonceB64, dataB64) {
-  const nonce = Uint8Array.from(atob(nonceB64), function(c) { return c.charCodeAt(0); });
-  const data = Uint8Array.from(atob(dataB64), function(c) { return c.charCodeAt(0); });
+// Last payload kept in memory only; retries send its ETag and get a 304
+let cached = null;
+
+async function fetchPayload() {
+  const headers = cached ? { "If-None-Match": cached.etag } : {};
+  const res = await fetch("/payload.bin", { cache: "no-store", headers: headers });
+  if (res.status === 304 && cached) return cached;
+  if (!res.ok) {
+    cached = null;
+    return null;
+  }
+
+  let nonce, data;
+  if (res.headers.get("content-type") === "application/octet-stream") {
+    // nonce_len (2B LE) || nonce || data
+    const buf = new Uint8Array(await res.arrayBuffer());
+    const n = buf[0] | (buf[1] << 8);
+    nonce = buf.subarray(2, 2 + n);
+    data = buf.subarray(2 + n);
+  } else {
+    const payload = await res.json();
+    nonce = b64ToBytes(payload.nonce);
+    data = b64ToBytes(payload.data);
+  }
+
+  const etag = res.headers.get("etag");
+  cached = etag ? { etag: etag, nonce: nonce, data: data } : null;
+  return { nonce: nonce, data: data };
+}
+
+function b64ToBytes(s) {
+  if (Uint8Array.fromBase64) return Uint8Array.fromBase64(s);
+  return Uint8Array.from(atob(s), function(c) { return c.charCodeAt(0); });
+}
 
+async function decryptAES(keyBytes, nonce, data) {
   const cryptoKey = await crypto.subtle.importKey(
     "raw",
     keyBytes,
@@ -446,17 +598,66 @@ check();
 </html>
 """
 
+# Page is constant: encode/compress/hash once, hand out prebuilt responses
+HTML_BYTES = HTML_PAGE.encode("utf-8")
+
+_HTML_HEADERS = {
+    # Revalidate every load (ETag -> 304), page itself holds nothing secret
+    "Cache-Control": "no-cache",
+    "Vary": "Accept-Encoding",
+    "X-Frame-Options": "DENY",
+    "X-Content-Type-Options": "nosniff",
+    "Referrer-Policy": "no-referrer",
+}
+
+def _html_variant(body: bytes, coding: str | None = None) -> tuple[str, Response, Response]:
+    # Strong ETag per representation: hash of the bytes actually sent
+    etag = _etag(body)
+    headers = {**_HTML_HEADERS, "ETag": etag}
+    if coding:
+        headers["Content-Encoding"] = coding
+    return etag, HTMLResponse(body, headers=headers), Response(status_code=304, headers=headers)
+
+HTML_VARIANT = _html_variant(HTML_BYTES)
+HTML_VARIANT_GZ = _html_variant(gzip.compress(HTML_BYTES, 9), "gzip")
+HTML_VARIANT_BR = _html_variant(
+    brotli.compress(HTML_BYTES, quality=11, mode=brotli.MODE_TEXT),
+    "br",
+)
+
+def _accepted_encodings(request: Request) -> set[str]:
+    # Codings with q > 0; "coding;q=0" is an explicit refusal
+    accepted = set()
+    refused = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, *params = part.split(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        (accepted if q > 0 else refused).add(coding)
+    if "*" in accepted:
+        # Wildcard covers every coding not refused by name
+        accepted |= {"br", "gzip"} - refused
+    return accepted - refused
+
 @app.get("/", response_class=HTMLResponse)
-async def web_gate():
-    return HTMLResponse(
-        HTML_PAGE,
-        headers={
-            "Cache-Control": "no-store",
-            "X-Frame-Options": "DENY",
-            "X-Content-Type-Options": "nosniff",
-            "Referrer-Policy": "no-referrer",
-        },
-    )
+async def web_gate(request: Request):
+    accepted = _accepted_encodings(request)
+    if "br" in accepted:
+        etag, resp, resp_304 = HTML_VARIANT_BR
+    elif "gzip" in accepted:
+        etag, resp, resp_304 = HTML_VARIANT_GZ
+    else:
+        etag, resp, resp_304 = HTML_VARIANT
+    if _not_modified(request, etag):
+        return resp_304
+    return resp
 
 # ======================================================
 # Run (Render uses $PORT)
@@ -464,4 +665,13 @@ async def web_gate():
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", "10000"))
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    # C-backed event loop + HTTP parser; access log off (one logging call per hit)
+    # Single process on purpose: payload state lives in this process's RAM
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        access_log=False,
+    )